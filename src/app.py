@@ -3,6 +3,7 @@ import sys
 from pathlib import Path
 
 from flask import Flask
+from flask_session import Session
 
 # Ensure src directory is in Python path for imports
 src_dir = Path(__file__).parent
@@ -10,6 +11,7 @@ if str(src_dir) not in sys.path:
     sys.path.insert(0, str(src_dir))
 
 from config import config
+from json_provider import OrjsonProvider
 
 
 def create_app(config_name: str = 'development') -> Flask:
@@ -23,7 +25,9 @@ def create_app(config_name: str = 'development') -> Flask:
         Configured Flask application instance.
     """
     app = Flask(__name__, template_folder='templates', static_folder='static')
+    app.json = OrjsonProvider(app)
     app.config.from_object(config[config_name])
+    Session(app)
 
     # Register game blueprint
     from routes.game import game_bp  # pylint: disable=import-outside-toplevel
@@ -1,8 +1,10 @@
 """Application configuration management."""
+import functools
 import json
 from pathlib import Path
 
 
+@functools.lru_cache(maxsize=1)
 def load_config() -> dict:
     """Load configuration from config.json file.
 
@@ -12,8 +14,8 @@ def load_config() -> dict:
     config_file = Path(__file__).parent.parent / 'config.json'
 
     try:
-        with open(config_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(config_file, 'rb', buffering=65536) as f:
+            return json.loads(f.read())
     except (FileNotFoundError, json.JSONDecodeError):
         # Fallback defaults for development
         return {
@@ -41,6 +43,11 @@ class Config:
     BOARD_WIDTH = _grid_settings.get('width', 2)
     BOARD_HEIGHT = _grid_settings.get('height', 2)
     TOTAL_PAIRS = (BOARD_WIDTH * BOARD_HEIGHT) // 2
+    # Keep game state server-side; only the session id travels in the cookie
+    SESSION_TYPE = 'filesystem'
+    # Browser-session cookie as before; also means unmodified sessions are not rewritten
+    SESSION_PERMANENT = False
+    SESSION_FILE_DIR = str(Path(__file__).parent.parent / 'flask_session')
 
 
 class DevelopmentConfig(Config):
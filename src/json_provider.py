@@ -0,0 +1,45 @@
+"""orjson-backed JSON provider for Flask responses and request parsing."""
+from typing import Any
+
+import orjson
+from flask import Response
+from flask.json.provider import JSONProvider
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider using orjson's C encoder and parser."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        """Serialize data to a JSON string.
+
+        Args:
+            obj: Data to serialize.
+            **kwargs: Ignored; orjson has no stdlib-compatible options.
+
+        Returns:
+            JSON string.
+        """
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        """Deserialize data from a JSON string or bytes.
+
+        Args:
+            s: JSON text.
+            **kwargs: Ignored; orjson has no stdlib-compatible options.
+
+        Returns:
+            Deserialized data.
+        """
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        """Serialize data to an application/json response.
+
+        Writes orjson's bytes output directly, skipping the str round trip.
+
+        Returns:
+            Response object with JSON body.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
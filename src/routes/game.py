@@ -1,47 +1,81 @@
 """Game routes and business logic for memory matching game."""
+import os
 import random
-from pathlib import Path
-
-from flask import Blueprint, jsonify, render_template, request, send_file, session
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import (
+    Blueprint,
+    Response,
+    json,
+    jsonify,
+    render_template,
+    request,
+    send_from_directory,
+    session,
+)
+from werkzeug.exceptions import NotFound
 
 from config import Config
 from crop_service import (
-    copy_square_image,
+    IMG_DIR,
+    SQUARED_DIR,
     get_image_dimensions,
     get_largest_square_dimensions,
     get_safe_image_path,
-    is_square_image,
+    get_square_filename,
+    process_image,
     save_cropped_image,
 )
 
 game_bp = Blueprint('game', __name__)
 
+# Let browsers cache versioned card images instead of refetching them every game
+IMAGE_MAX_AGE = 86400
+# Whole-name match: no hidden files or bare extensions, nothing after the extension
+_IMAGE_NAME_RE = re.compile(r'[^.].*\.(?:png|jpe?g|gif|webp)', re.IGNORECASE)
+
+# Directory listing cache, invalidated when img/ mtime changes
+_FILES_CACHE = {'mtime_ns': 0, 'files': [], 'square_map': {}}
+
+# Process-local RNG for image selection and card shuffling
+_RNG = random.Random()
+
 
-def _get_image_files() -> list[Path]:
-    """Get all image file paths from img directory (excludes squared/ folder).
+def _get_image_files() -> list[tuple[str, str]]:
+    """Get all image files from img directory (excludes squared/ folder).
+
+    The listing is cached and only rebuilt when the directory mtime changes,
+    together with each file's squared filename.
 
     Returns:
-        List of Path objects for image files.
+        List of (filename, full path) tuples for image files.
     """
-    img_dir = Path(__file__).parent.parent.parent / 'img'
-    img_extensions = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+    global _FILES_CACHE
 
-    if not img_dir.exists():
+    try:
+        mtime_ns = os.stat(IMG_DIR).st_mtime_ns
+    except FileNotFoundError:
         return []
 
-    return [
-        f for f in img_dir.iterdir()
-        if f.is_file() and f.suffix.lower() in img_extensions
-    ]
-
+    cache = _FILES_CACHE
+    if mtime_ns == cache['mtime_ns']:
+        return cache['files']
 
-def get_all_images() -> list[str]:
-    """Get all base image files from img directory (excludes squared/ folder).
+    with os.scandir(IMG_DIR) as entries:
+        files = [
+            (entry.name, entry.path) for entry in entries
+            if _IMAGE_NAME_RE.fullmatch(entry.name) and entry.is_file(follow_symlinks=False)
+        ]
 
-    Returns:
-        Sorted list of base image filenames.
-    """
-    return sorted([f.name for f in _get_image_files()])
+    # Swap in a complete snapshot so concurrent readers never see a new
+    # mtime paired with a stale listing
+    _FILES_CACHE = {
+        'mtime_ns': mtime_ns,
+        'files': files,
+        'square_map': {name: get_square_filename(name) for name, _ in files},
+    }
+    return files
 
 
 def _get_k_random_images(k: int) -> list[str]:
@@ -57,28 +91,43 @@ def _get_k_random_images(k: int) -> list[str]:
         List of k randomly selected image filenames.
     """
     files = _get_image_files()
-    if len(files) <= k:
-        return [f.name for f in files]
-    
-    # random.sample() can work on iterables, but for efficiency
-    # with large n, we convert to names only for selected items
-    selected_paths = random.sample(files, k)
-    return [f.name for f in selected_paths]
+    if len(files) > k:
+        # Sample (name, path) tuples first so only k names are extracted
+        files = _RNG.sample(files, k)
+    return [name for name, _ in files]
+
+
+def _scan_squared_names() -> set[str]:
+    """Get filenames present in squared/ folder.
+
+    Returns:
+        Set of squared filenames (e.g., 'photo_square.jpg').
+    """
+    try:
+        with os.scandir(SQUARED_DIR) as entries:
+            return {entry.name for entry in entries}
+    except FileNotFoundError:
+        return set()
+
+
+# Squared filenames known to exist; scanned once, then kept current as
+# this process creates squared versions and setup_card_pairs finds ones
+# that were deleted
+_CROPPED_DONE: set[str] = _scan_squared_names()
 
 
-def _get_cropped_version_path(base_filename: str) -> Path:
-    """Get path to cropped version of an image.
+def _get_square_name(base_filename: str) -> str:
+    """Get filename of cropped version of an image.
 
     Args:
         base_filename: Original image filename (e.g., 'photo.jpg').
 
     Returns:
-        Path object for the cropped version (e.g., img/squared/photo_square.jpg).
+        Cropped filename (e.g., 'photo_square.jpg').
     """
-    img_dir = Path(__file__).parent.parent.parent / 'img'
-    squared_dir = img_dir / 'squared'
-    name_without_ext = base_filename.rsplit('.', 1)[0] if '.' in base_filename else base_filename
-    return squared_dir / f"{name_without_ext}_square.jpg"
+    # Listed images are precomputed; other names (e.g. from URLs) are built
+    square_name = _FILES_CACHE['square_map'].get(base_filename)
+    return square_name or get_square_filename(base_filename)
 
 
 def _has_cropped_version(base_filename: str) -> bool:
@@ -90,7 +139,7 @@ def _has_cropped_version(base_filename: str) -> bool:
     Returns:
         True if cropped version exists, False otherwise.
     """
-    return _get_cropped_version_path(base_filename).exists()
+    return _get_square_name(base_filename) in _CROPPED_DONE
 
 
 def _get_display_filename(base_filename: str) -> str:
@@ -102,45 +151,60 @@ def _get_display_filename(base_filename: str) -> str:
     Returns:
         Filename to display (e.g., 'photo.jpg' or 'squared/photo_square.jpg').
     """
-    if _has_cropped_version(base_filename):
-        name_without_ext = base_filename.rsplit('.', 1)[0] if '.' in base_filename else base_filename
-        return f"squared/{name_without_ext}_square.jpg"
+    square_name = _get_square_name(base_filename)
+    if square_name in _CROPPED_DONE:
+        return f"squared/{square_name}"
     return base_filename
 
 
-def get_images() -> list[str]:
-    """Get k randomly selected images for current game.
+def _safe_join(filepath: str) -> str | None:
+    """Join a URL-supplied path onto img directory without touching the filesystem.
 
-    Selects k = (board_width * board_height) / 2 base images randomly.
-    Returns display filenames (cropped if available, else original).
+    Args:
+        filepath: Relative image path from the request URL.
 
     Returns:
-        List of k display filenames to use in the game.
+        Normalized path string inside img directory, None if it could escape.
     """
-    k = (Config.BOARD_WIDTH * Config.BOARD_HEIGHT) // 2
-    selected = _get_k_random_images(k)
-    
-    # Convert to display filenames
-    return [_get_display_filename(img) for img in selected]
+    # Textual check only: resolve() would stat every path component
+    if '..' in filepath.split('/') or filepath.startswith('/') or '\\' in filepath:
+        return None
 
+    candidate = os.path.normpath(os.path.join(IMG_DIR, filepath))
+    return candidate if candidate.startswith(IMG_DIR + os.sep) else None
 
-def get_image_path(filename: str) -> Path | None:
+
+def get_image_path(filename: str) -> str | None:
     """Retrieve safe path to image file with directory traversal prevention.
 
     Args:
         filename: Image filename to retrieve.
 
     Returns:
-        Path object if file exists and is in img directory, None otherwise.
+        Path string if file exists and is in img directory, None otherwise.
     """
-    img_dir = Path(__file__).parent.parent.parent / 'img'
-    file_path = img_dir / filename
+    file_path = _safe_join(filename)
 
-    # Security check: ensure file is within img directory
-    if file_path.resolve().parent != img_dir.resolve():
+    # Security check: ensure file is directly within img directory
+    if not file_path or os.path.dirname(file_path) != IMG_DIR:
         return None
 
-    return file_path if file_path.exists() else None
+    return file_path if os.path.isfile(file_path) else None
+
+
+def _process_one(base_filename: str) -> str | None:
+    """Copy an image to squared/ folder if square, else flag it for cropping.
+
+    Args:
+        base_filename: Original image filename.
+
+    Returns:
+        The filename if it still needs cropping, None otherwise.
+    """
+    is_square, square_filename = process_image(base_filename)
+    if square_filename:
+        _CROPPED_DONE.add(square_filename)
+    return None if is_square else base_filename
 
 
 def init_game_state() -> None:
@@ -154,33 +218,32 @@ def init_game_state() -> None:
     
     Only checks k images for square dimensions, not all n images.
     """
-    k = (Config.BOARD_WIDTH * Config.BOARD_HEIGHT) // 2
+    k = Config.TOTAL_PAIRS
     
     # Randomly select only k images (efficient for large n)
     selected_base = _get_k_random_images(k)
     
     # Identify which of the k images need cropping
     # If already square, copy directly; otherwise mark for cropping
+    unprocessed = [img for img in selected_base if not _has_cropped_version(img)]
     pending_crops = []
-    for img in selected_base:
-        if not _has_cropped_version(img):
-            if is_square_image(img):
-                # Already square, copy to squared folder
-                copy_square_image(img)
-            else:
-                # Not square, needs cropping
-                pending_crops.append(img)
+    if unprocessed:
+        # Pillow releases the GIL during decode/encode, so threads overlap the work
+        with ThreadPoolExecutor(max_workers=min(8, len(unprocessed))) as executor:
+            results = list(executor.map(_process_one, unprocessed))
+        pending_crops = [img for img in results if img]
 
     # Store BASE filenames (not display names)
     # The server will serve cropped versions if they exist
-    session['all_game_images'] = selected_base
-    session['pending_crops'] = pending_crops
-    session['cards'] = []
-    session['matched'] = []
-    session['current_player'] = 1
-    session['player1_matches'] = []
-    session['player2_matches'] = []
-    session.modified = True
+    session.update({
+        'all_game_images': selected_base,
+        'pending_crops': pending_crops,
+        'cards': [],
+        'matched': [],
+        'current_player': 1,
+        'player1_pairs': 0,
+        'player2_pairs': 0,
+    })
 
 
 def get_card_image(card_value: int) -> str | None:
@@ -192,20 +255,39 @@ def get_card_image(card_value: int) -> str | None:
     Returns:
         Image filename or None if index is out of bounds.
     """
-    images = session.get('all_game_images', [])
+    images = session.get('display_images', [])
     if 0 <= card_value < len(images):
         return images[card_value]
     return None
 
 
 def setup_card_pairs() -> None:
-    """Setup shuffled card pairs after all crops are done."""
-    images = session.get('all_game_images', [])
-    pairs = list(range(len(images))) * 2
-    random.shuffle(pairs)
-    session['cards'] = pairs
-    session['matched'] = []
-    session.modified = True
+    """Setup shuffled card pairs after all crops are done.
+
+    Display filenames are fixed from here on, so they are resolved once
+    and stored in session for the board, init and match responses.
+    Squared versions are checked on disk once per game and versioned by
+    mtime, so a regenerated file gets a new URL. If one has gone missing,
+    the original is shown instead and it is reprocessed next game.
+    """
+    images = []
+    for img in session.get('all_game_images', []):
+        display = _get_display_filename(img)
+        if display != img:
+            try:
+                display += f"?v={os.stat(os.path.join(IMG_DIR, display)).st_mtime_ns}"
+            except FileNotFoundError:
+                # Forget it so the next init_game_state squares it again
+                _CROPPED_DONE.discard(_get_square_name(img))
+                display = img
+        images.append(display)
+    pairs = [i for i in range(len(images)) for _ in (0, 1)]
+    _RNG.shuffle(pairs)
+    session.update({
+        'display_images': images,
+        'cards': pairs,
+        'matched': [],
+    })
 
 
 @game_bp.route('/')
@@ -224,6 +306,24 @@ def crop_tool(filename: str):
     return render_template('crop_tool.html', filename=filename)
 
 
+def _send_image(directory: str, filename: str, max_age: int) -> Response:
+    """Send image file with private, conditional caching.
+
+    Args:
+        directory: Directory to serve from.
+        filename: Path relative to directory.
+        max_age: Cache lifetime in seconds (0 forces revalidation).
+
+    Returns:
+        File response; raises NotFound if file does not exist.
+    """
+    response = send_from_directory(directory, filename, max_age=max_age)
+    # Responses can carry the session cookie, so keep them out of shared caches
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+
 @game_bp.route('/img/<path:filepath>')
 def serve_image(filepath: str):
     """Serve image files from img directory, preferring cropped versions if they exist.
@@ -236,27 +336,30 @@ def serve_image(filepath: str):
     Returns:
         File response or 404 JSON error.
     """
-    img_dir = Path(__file__).parent.parent.parent / 'img'
-    
-    # First, try to serve cropped version if it exists
-    cropped_path = _get_cropped_version_path(filepath)
-    if cropped_path.exists():
-        # Security check: ensure file is within img directory
-        if not cropped_path.resolve().parent.as_posix().startswith(img_dir.resolve().as_posix()):
-            return jsonify({'error': 'Invalid path'}), 404
-        return send_file(str(cropped_path), mimetype='image/*')
-    
-    # Otherwise serve the original
-    file_path = img_dir / filepath
-    
     # Security check: ensure file is within img directory
-    if not file_path.resolve().parent.as_posix().startswith(img_dir.resolve().as_posix()):
+    if not _safe_join(filepath):
         return jsonify({'error': 'Invalid path'}), 404
 
-    if not file_path.exists():
-        return jsonify({'error': 'Image not found'}), 404
+    # Display names point into squared/ directly; only versioned URLs
+    # (?v=<mtime>) may be cached, since a squared file can be regenerated
+    if filepath.startswith('squared/'):
+        max_age = IMAGE_MAX_AGE if 'v' in request.args else 0
+        try:
+            return _send_image(IMG_DIR, filepath, max_age)
+        except NotFound:
+            return jsonify({'error': 'Image not found'}), 404
+
+    # Unversioned URLs always revalidate: the same URL switches from the
+    # original to the cropped version once that has been created
+    try:
+        return _send_image(SQUARED_DIR, _get_square_name(filepath), 0)
+    except NotFound:
+        pass
 
-    return send_file(str(file_path), mimetype='image/*')
+    try:
+        return _send_image(IMG_DIR, filepath, 0)
+    except NotFound:
+        return jsonify({'error': 'Image not found'}), 404
 
 
 @game_bp.route('/api/image/dimensions/<filename>')
@@ -301,12 +404,13 @@ def save_crop():
     temp_filename = save_cropped_image(filename, crop_box)
     if not temp_filename:
         return jsonify({'error': 'Crop failed'}), 400
+    _CROPPED_DONE.add(temp_filename)
 
-    session['pending_crops'].remove(filename)
-    session.modified = True
+    # Reassign rather than mutate in place so the session sees the change
+    pending = [img for img in session.get('pending_crops', []) if img != filename]
+    session['pending_crops'] = pending
 
     # Check if more crops are needed
-    pending = session.get('pending_crops', [])
     if pending:
         return jsonify({
             'status': 'pending_crops',
@@ -315,10 +419,21 @@ def save_crop():
 
     # All crops done, setup card pairs
     setup_card_pairs()
-    session.modified = True
     return jsonify({'status': 'ok'})
 
 
+def _game_ready_response():
+    """Build init response for a game that is ready to play."""
+    images = session['display_images']
+    return jsonify({
+        'status': 'ok',
+        'board_width': Config.BOARD_WIDTH,
+        'board_height': Config.BOARD_HEIGHT,
+        'images': images,
+        'total_pairs': len(images)
+    })
+
+
 @game_bp.route('/api/game/init', methods=['POST'])
 def init():
     """Initialize new game with fresh board and shuffled cards.
@@ -327,25 +442,31 @@ def init():
     Otherwise returns game configuration.
     
     Only selects fresh images on first call. After crops complete,
-    subsequent calls reuse the same images.
+    subsequent calls reuse the same images. A board that is already
+    set up is returned as is instead of being reshuffled.
     """
+    # Board already dealt (e.g. returning from crop tool or a refresh)
+    if session.get('cards') and not session.get('pending_crops'):
+        return _game_ready_response()
+
     # Only select new images if no game is in progress
     if 'all_game_images' not in session:
         # Fresh start - initialize with random images
         init_game_state()
     else:
         # Game already started, just reset play state
-        session['matched'] = []
-        session['current_player'] = 1
-        session['player1_matches'] = []
-        session['player2_matches'] = []
-        session['cards'] = []
-    
+        session.update({
+            'matched': [],
+            'current_player': 1,
+            'player1_pairs': 0,
+            'player2_pairs': 0,
+            'cards': [],
+        })
+
     # Check for pending crops
     pending = session.get('pending_crops', [])
 
     if pending:
-        session.modified = True
         return jsonify({
             'status': 'pending_crops',
             'pending_image': pending[0],
@@ -354,16 +475,7 @@ def init():
 
     # Always setup fresh card pairs (no pending crops, so ready to play)
     setup_card_pairs()
-    
-    images = session.get('all_game_images', [])
-    session.modified = True
-    return jsonify({
-        'status': 'ok',
-        'board_width': Config.BOARD_WIDTH,
-        'board_height': Config.BOARD_HEIGHT,
-        'images': images,
-        'total_pairs': len(images)
-    })
+    return _game_ready_response()
 
 
 @game_bp.route('/api/game/board')
@@ -388,14 +500,16 @@ def get_board():
         if not session.get('cards'):
             return jsonify({'error': 'No cards in session'}), 400
 
-        return jsonify({
+        response = Response(json.dumps({
             'cards': session['cards'],
+            'images': session.get('display_images', session['all_game_images']),
             'matched': session['matched'],
             'current_player': session['current_player'],
-            'player1_pairs': len(session['player1_matches']),
-            'player2_pairs': len(session['player2_matches']),
-            'images': session.get('all_game_images', [])
-        })
+            'player1_pairs': session.get('player1_pairs', 0),
+            'player2_pairs': session.get('player2_pairs', 0),
+        }), mimetype='application/json')
+        response.add_etag()
+        return response.make_conditional(request)
     except Exception as e:
         import traceback
         print(f"Error in get_board: {e}")
@@ -416,8 +530,8 @@ def check_match(card1: int, card2: int):
     """
     cards = session.get('cards', [])
     matched = session.get('matched', [])
-    player1_matches = session.get('player1_matches', [])
-    player2_matches = session.get('player2_matches', [])
+    player1_pairs = session.get('player1_pairs', 0)
+    player2_pairs = session.get('player2_pairs', 0)
     current_player = session.get('current_player', 1)
 
     # Validate card indices
@@ -438,10 +552,11 @@ def check_match(card1: int, card2: int):
     if is_match:
         # Record matched cards
         matched.extend([card1, card2])
+        # Only pair counts are ever reported, so store counts, not card lists
         if current_player == 1:
-            player1_matches.append(card1_val)
+            player1_pairs += 1
         else:
-            player2_matches.append(card1_val)
+            player2_pairs += 1
         game_over = len(matched) == len(cards)
     else:
         # Switch player on mismatch
@@ -449,19 +564,20 @@ def check_match(card1: int, card2: int):
         game_over = False
 
     # Persist updated state
-    session['matched'] = matched
-    session['current_player'] = current_player
-    session['player1_matches'] = player1_matches
-    session['player2_matches'] = player2_matches
-    session.modified = True
+    session.update({
+        'matched': matched,
+        'current_player': current_player,
+        'player1_pairs': player1_pairs,
+        'player2_pairs': player2_pairs,
+    })
 
     return jsonify({
         'is_match': is_match,
         'image1': img1,
         'image2': img2,
         'current_player': current_player,
-        'player1_pairs': len(player1_matches),
-        'player2_pairs': len(player2_matches),
+        'player1_pairs': player1_pairs,
+        'player2_pairs': player2_pairs,
         'matched_indices': matched,
         'game_over': game_over
     })
@@ -474,5 +590,4 @@ def reset():
     Next call to /api/game/init will select fresh random images.
     """
     session.clear()
-    session.modified = True
     return jsonify({'status': 'ok'})